@@ -36,6 +36,10 @@ def validate_config(cfg: DictConfig) -> DictConfig:
     logger.debug("Requested GPUs: %s", cfg.gpus)
     cfg.gpus = min(torch.cuda.device_count(), cfg.gpus)
     logger.debug("GPU count set to: %s", cfg.gpus)
+    if cfg.val_subsample.enabled and cfg.gpus > 1:
+        # The full validation set is gated by a custom sampler, which lightning cannot
+        #  replace with a distributed sampler.
+        raise ValueError("`val_subsample.enabled` is not supported with more than one GPU.")
 
     # Model specific configuration
     ## ADD YOURS HERE
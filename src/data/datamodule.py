@@ -3,18 +3,30 @@ from pytorch_lightning import LightningDataModule
 from torch_geometric.loader import DataLoader
 #from torch.loader import DataLoader # TODO Change if not using torch_geometric
 
+from torch.utils.data import Subset
+
+from src.data.subsample import GatedSampler, stratified_subsample
+from src.utils.telemetry import register_dataloader_worker
 from src.utils.transforms import get_transforms
 
 class SampleDatamodule(pl.LightningDataModule):
     def __init__(self, data_dir: str = "path/to/dir",
                  batch_size: int = 32,
                  dataset_name: str = "sample_dataset",
-                 transforms=None):
+                 transforms=None,
+                 val_subsample_fraction: float = None,
+                 val_subsample_seed: int = 0):
         super().__init__()
         self.data_dir = data_dir
         self.batch_size = batch_size
         self.dataset_name = dataset_name
         self.transforms = transforms
+        # If set, frequent validation runs on a fixed stratified subsample of the validation
+        #  set, and the full set is only evaluated when `full_val_sampler` is opened (see
+        #  `src.utils.callbacks.FullValidationGate`).
+        self.val_subsample_fraction = val_subsample_fraction
+        self.val_subsample_seed = val_subsample_seed
+        self.full_val_sampler = None
         
     def download(self):
         # Download data
@@ -48,16 +60,40 @@ class SampleDatamodule(pl.LightningDataModule):
         raise NotImplementedError("Another dataset not implemented yet")
 
     def train_dataloader(self):
-        return DataLoader(self.train_dataset, batch_size=self.batch_size)
+        return DataLoader(self.train_dataset, batch_size=self.batch_size,
+                          worker_init_fn=register_dataloader_worker)
 
     def val_dataloader(self):
-        return DataLoader(self.val_dataset, batch_size=self.batch_size)
+        if self.val_subsample_fraction is None:
+            return DataLoader(self.val_dataset, batch_size=self.batch_size,
+                              worker_init_fn=register_dataloader_worker)
+
+        # Datasets can expose a per-sample `strata` label (e.g. a size or family bin) to
+        #  stratify the subsample by, otherwise a uniform subsample is used.
+        indices = stratified_subsample(len(self.val_dataset),
+                                       fraction=self.val_subsample_fraction,
+                                       strata=getattr(self.val_dataset, "strata", None),
+                                       seed=self.val_subsample_seed)
+        if len(indices) < 2:
+            raise ValueError(
+                f"The validation subsample has {len(indices)} sample(s), at least 2 are needed "
+                "for a confidence interval. Increase `val_subsample.fraction`.")
+        self.full_val_sampler = GatedSampler(len(self.val_dataset))
+        return [
+            DataLoader(Subset(self.val_dataset, indices), batch_size=self.batch_size,
+                       worker_init_fn=register_dataloader_worker),
+            DataLoader(self.val_dataset, batch_size=self.batch_size,
+                       sampler=self.full_val_sampler,
+                       worker_init_fn=register_dataloader_worker),
+        ]
 
     def test_dataloader(self):
-        return DataLoader(self.test_dataset, batch_size=self.batch_size)
+        return DataLoader(self.test_dataset, batch_size=self.batch_size,
+                          worker_init_fn=register_dataloader_worker)
 
     def predict_dataloader(self):
-        return DataLoader(self.predict_dataset, batch_size=self.batch_size)
+        return DataLoader(self.predict_dataset, batch_size=self.batch_size,
+                          worker_init_fn=register_dataloader_worker)
 
     def teardown(self, stage: str):
         # Used to clean-up when the run is finished
@@ -72,6 +108,9 @@ def get_datamodule(cfg):
     datamodule = SampleDatamodule(data_dir=cfg.data_dir,
                                   batch_size=cfg.batch_size,
                                   dataset_name=cfg.dataset_name,
-                                  transforms=transforms)
+                                  transforms=transforms,
+                                  val_subsample_fraction=cfg.val_subsample.fraction
+                                  if cfg.val_subsample.enabled else None,
+                                  val_subsample_seed=cfg.val_subsample.seed)
     
     return datamodule
\ No newline at end of file
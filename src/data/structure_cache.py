@@ -0,0 +1,290 @@
+"""On-disk cache of parsed protein structures in a compact columnar layout.
+
+Each structure is parsed once (PDB or mmCIF via biopython) and stored as a directory of
+`.npy` columns plus a small `meta.json` holding the string tables and the hash of the
+source file. Columns are opened with `numpy.memmap` (`mmap_mode="r"`), so loading a cached
+structure does not rebuild any Python objects per atom.
+
+Layout of a cache entry:
+    <cache_dir>/<file stem>-<path digest>/
+        current.json               source size/mtime and the version directory in use
+        <source sha1>-v<format>/   immutable once created
+            coords.npy     float32 (n_atoms, 3)
+            element.npy    uint8   (n_atoms,)  index into `elements`
+            atom_name.npy  uint16  (n_atoms,)  index into `atom_names`
+            residue.npy    uint8   (n_atoms,)  index into `residues`
+            res_id.npy     int32   (n_atoms,)  residue sequence number
+            icode.npy      uint8   (n_atoms,)  index into `icodes` (insertion code)
+            hetero.npy     bool    (n_atoms,)  HETATM residue (ligand, water, ...)
+            chain.npy      uint16  (n_atoms,)  index into `chains`
+            meta.json      string tables, source hash, cache format version
+
+Version directories are created under a temporary name and renamed into place, and
+`current.json` is replaced atomically, so concurrent writers and readers (e.g. several
+experiments or DataLoader workers) never observe a half-written entry. The source file is
+only re-hashed when its size or modification time changed.
+"""
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from Bio.PDB import MMCIFParser, PDBParser
+
+from src.utils.logutils import get_logger
+
+logger = get_logger(__name__)
+
+CACHE_FORMAT_VERSION = 2
+_META_FILE = "meta.json"
+_POINTER_FILE = "current.json"
+# Column name -> dtype of the stored codes / values
+_COLUMNS = {
+    "coords": np.float32,
+    "element": np.uint8,
+    "atom_name": np.uint16,
+    "residue": np.uint8,
+    "res_id": np.int32,
+    "icode": np.uint8,
+    "hetero": np.bool_,
+    "chain": np.uint16,
+}
+_TABLES = {
+    "element": "elements",
+    "atom_name": "atom_names",
+    "residue": "residues",
+    "icode": "icodes",
+    "chain": "chains",
+}
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class CachedStructure:
+    """Columnar view of a parsed structure. Arrays are read-only memmaps."""
+
+    coords: np.ndarray
+    element: np.ndarray
+    atom_name: np.ndarray
+    residue: np.ndarray
+    res_id: np.ndarray
+    icode: np.ndarray
+    hetero: np.ndarray
+    chain: np.ndarray
+    elements: List[str]
+    atom_names: List[str]
+    residues: List[str]
+    icodes: List[str]
+    chains: List[str]
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+
+def file_hash(path: os.PathLike) -> str:
+    """Return the sha1 hex digest of the contents of the file at `path`."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode(values: List[str], dtype: np.dtype) -> Tuple[np.ndarray, List[str]]:
+    """Encode a list of strings as integer codes into a table of unique strings."""
+    table: Dict[str, int] = {}
+    codes = np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.int64)
+    if len(table) > np.iinfo(dtype).max + 1:
+        raise ValueError(f"{len(table)} unique values do not fit into {np.dtype(dtype).name}.")
+    return codes.astype(dtype), list(table)
+
+
+def parse_structure(path: os.PathLike) -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+    """Parse the first model of a PDB/mmCIF file into columns and string tables."""
+    path = pathlib.Path(path)
+    if path.suffix.lower() in (".cif", ".mmcif"):
+        parser = MMCIFParser(QUIET=True)
+    else:
+        parser = PDBParser(QUIET=True)
+    model = next(iter(parser.get_structure(path.stem, path)))
+
+    coords, elements, atom_names, residues, chains = [], [], [], [], []
+    res_ids, icodes, hetero = [], [], []
+    for atom in model.get_atoms():
+        residue = atom.get_parent()
+        # Residue ids are (hetero flag, sequence number, insertion code), e.g. ("H_HEM", 52, "A")
+        hetero_flag, res_id, icode = residue.get_id()
+        coords.append(atom.get_coord())
+        elements.append(atom.element)
+        atom_names.append(atom.get_name())
+        residues.append(residue.get_resname())
+        res_ids.append(res_id)
+        icodes.append(icode)
+        hetero.append(hetero_flag != " ")
+        chains.append(residue.get_parent().id)
+
+    columns = {
+        "coords": np.asarray(coords, dtype=np.float32).reshape(-1, 3),
+        "res_id": np.asarray(res_ids, dtype=np.int32),
+        "hetero": np.asarray(hetero, dtype=np.bool_),
+    }
+    tables = {}
+    for column, values in (
+        ("element", elements),
+        ("atom_name", atom_names),
+        ("residue", residues),
+        ("icode", icodes),
+        ("chain", chains),
+    ):
+        columns[column], tables[_TABLES[column]] = _encode(values, _COLUMNS[column])
+    return columns, tables
+
+
+class StructureCache:
+    """Parse-once cache for protein structures, invalidated by source file hash.
+
+    Example:
+        cache = StructureCache("path/to/structure_cache")
+        structure = cache.load("path/to/1abc.pdb")
+        ca_coords = structure.coords[structure.atom_name == structure.atom_names.index("CA")]
+    """
+
+    def __init__(self, cache_dir: os.PathLike) -> None:
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def entry_dir(self, path: os.PathLike) -> pathlib.Path:
+        """Return the cache directory used for the structure file at `path`."""
+        path = pathlib.Path(path).resolve()
+        path_digest = hashlib.sha1(str(path).encode()).hexdigest()[:16]
+        return self.cache_dir / f"{path.stem}-{path_digest}"
+
+    def version_dir(self, path: os.PathLike, source_hash: str) -> pathlib.Path:
+        """Return the directory holding the columns of `path` with contents `source_hash`."""
+        return self.entry_dir(path) / f"{source_hash}-v{CACHE_FORMAT_VERSION}"
+
+    @staticmethod
+    def _read_json(file_path: pathlib.Path) -> Dict:
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _stat_key(path: os.PathLike) -> List[int]:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _current(self, path: os.PathLike) -> Optional[pathlib.Path]:
+        """Version directory in use for `path` if its size and mtime are unchanged."""
+        pointer = self._read_json(self.entry_dir(path) / _POINTER_FILE)
+        if pointer.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        if pointer.get("stat") != self._stat_key(path):
+            return None
+        version_dir = self.entry_dir(path) / pointer["version_dir"]
+        # The version may have been pruned or deleted since, then re-parse
+        if not (version_dir / _META_FILE).exists():
+            return None
+        return version_dir
+
+    def _set_current(self, path: os.PathLike, version_dir: pathlib.Path, stat_key) -> None:
+        pointer = {
+            "version": CACHE_FORMAT_VERSION,
+            "stat": stat_key,
+            "version_dir": version_dir.name,
+        }
+        entry = self.entry_dir(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{_POINTER_FILE}-", dir=entry)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(pointer, file)
+            os.replace(tmp_path, entry / _POINTER_FILE)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def is_valid(self, path: os.PathLike) -> bool:
+        """Whether the cache entry for `path` is up to date without re-hashing the source."""
+        return self._current(path) is not None
+
+    def write(self, path: os.PathLike, source_hash: Optional[str] = None) -> pathlib.Path:
+        """Parse the structure at `path` into the version directory for its contents.
+
+        Returns the version directory. If another process created it concurrently, that
+        version is used and this one discarded.
+        """
+        source_hash = source_hash or file_hash(path)
+        target = self.version_dir(path, source_hash)
+        if (target / _META_FILE).exists():
+            return target
+
+        columns, tables = parse_structure(path)
+        meta = {
+            "version": CACHE_FORMAT_VERSION,
+            "source": str(pathlib.Path(path).resolve()),
+            "source_hash": source_hash,
+            "n_atoms": len(columns["coords"]),
+            **tables,
+        }
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix=f".{target.name}-", dir=target.parent))
+        try:
+            for column, values in columns.items():
+                np.save(tmp_dir / f"{column}.npy", values)
+            with open(tmp_dir / _META_FILE, "w", encoding="utf-8") as file:
+                json.dump(meta, file)
+            try:
+                os.rename(tmp_dir, target)
+            except OSError as error:
+                # Lost the race against another writer: its (identical) version is complete.
+                if error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise
+                logger.debug("%s was cached concurrently, using existing entry.", path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        logger.debug("Cached %s atoms of %s at %s", meta["n_atoms"], path, target)
+        return target
+
+    @staticmethod
+    def read(version_dir: pathlib.Path) -> CachedStructure:
+        """Open a version directory as memmaps."""
+        meta = StructureCache._read_json(version_dir / _META_FILE)
+        columns = {
+            column: np.load(version_dir / f"{column}.npy", mmap_mode="r") for column in _COLUMNS
+        }
+        tables = {table: meta[table] for table in _TABLES.values()}
+        return CachedStructure(**columns, **tables)
+
+    def load(self, path: os.PathLike) -> CachedStructure:
+        """Return the cached structure for `path`, parsing it first if the cache is stale."""
+        version_dir = self._current(path)
+        if version_dir is None:
+            # Size or mtime changed (or no entry yet): only now hash the contents, which may
+            #  still match an existing version (e.g. the file was just touched or copied).
+            stat_key = self._stat_key(path)
+            source_hash = file_hash(path)
+            version_dir = self.version_dir(path, source_hash)
+            if not (version_dir / _META_FILE).exists():
+                logger.debug("Cache miss for %s, parsing.", path)
+                version_dir = self.write(path, source_hash=source_hash)
+            self._set_current(path, version_dir, stat_key)
+        return self.read(version_dir)
+
+    def prune(self, path: os.PathLike) -> None:
+        """Remove versions of `path` other than the current one.
+        NOTE: Only call this while no other process reads the cache entry of `path`.
+        """
+        current = self._current(path)
+        if current is None:
+            return
+        for child in self.entry_dir(path).iterdir():
+            if child.is_dir() and child != current:
+                shutil.rmtree(child, ignore_errors=True)
@@ -0,0 +1,64 @@
+"""Deterministic, stratified validation subsets and a sampler for occasional full validation."""
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def stratified_subsample(
+    n_samples: int,
+    fraction: float,
+    strata: Optional[Sequence] = None,
+    seed: int = 0,
+) -> np.ndarray:
+    """Return sorted indices of a deterministic stratified subsample.
+
+    Every stratum contributes `fraction` of its samples (rounded, at least one), so the
+    subsample keeps the stratum proportions of the full set.
+    Args:
+        n_samples (int): Size of the full dataset.
+        fraction (float): Fraction of samples to keep, in (0, 1].
+        strata (Sequence, optional): Stratum label for each sample. Defaults to a single
+            stratum.
+        seed (int, optional): Seed for the selection within each stratum. Defaults to 0.
+    Returns:
+        indices (np.ndarray): Sorted int64 indices into the dataset.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f"`fraction` must be in (0, 1], got {fraction}.")
+    if strata is None:
+        strata = np.zeros(n_samples, dtype=np.int64)
+    strata = np.asarray(strata)
+    if len(strata) != n_samples:
+        raise ValueError(f"Got {len(strata)} strata labels for {n_samples} samples.")
+
+    rng = np.random.default_rng(seed)
+    selected = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        n_keep = max(1, int(round(fraction * len(members))))
+        selected.append(rng.choice(members, size=n_keep, replace=False))
+    return np.sort(np.concatenate(selected)).astype(np.int64)
+
+
+class GatedSampler(Sampler):
+    """Sequential sampler that yields nothing unless its gate is open.
+
+    Used for the full validation set when validating on a subsample: the dataloader is
+    always registered with the trainer, but only iterated at checkpoint boundaries.
+    NOTE: `__len__` always reports the full length, since lightning computes the number of
+    validation batches once and would otherwise never run this dataloader.
+    """
+
+    def __init__(self, n_samples: int) -> None:
+        super().__init__(None)
+        self.n_samples = n_samples
+        self.is_open = False
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.is_open:
+            return iter(())
+        return iter(range(self.n_samples))
+
+    def __len__(self) -> int:
+        return self.n_samples
@@ -0,0 +1,204 @@
+"""Shape-bucketed `torch.compile` for graph models.
+
+Graph batches have a different number of nodes and edges at every step, so a compiled model
+specialised on static shapes would recompile at every step. `BucketedCompiledModel` pads each
+batch up to one of a small set of bucket sizes, so that dynamo (with `dynamic=False`) only
+compiles one specialisation per bucket, keyed by its shape guards.
+
+Padding is done such that the math on the real graphs is unchanged:
+    * padded nodes have zero features and belong to an extra padding graph, so segment
+      reductions over `batch` never mix them with real graphs,
+    * padded edges connect padding nodes only, so no messages reach real nodes,
+    * `node_mask` and `edge_mask` are attached to the batch for anything that reduces over
+      the whole batch (e.g. batch norm), and `num_graphs` is set to the padded graph count.
+Outputs whose leading dimension matches the padded node, edge or graph count are sliced back
+to the real sizes. For this to be unambiguous the node and edge buckets must be disjoint, and
+the three padded sizes of a batch must differ (checked in `pad`).
+"""
+import bisect
+from typing import Any, Sequence, Tuple
+
+import torch
+import torch._dynamo
+from torch_geometric.data import Data
+
+from src.utils.logutils import get_logger
+
+logger = get_logger(__name__)
+
+# Node buckets are not powers of two so that they do not coincide with the edge and graph
+#  buckets (which are).
+DEFAULT_NODE_BUCKETS = (320, 640, 1280, 2560, 5120, 10240)
+DEFAULT_EDGE_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+def get_bucket(size: int, buckets: Sequence[int]) -> int:
+    """Return the smallest bucket >= `size`. Beyond the largest bucket, round up to a
+    multiple of it."""
+    idx = bisect.bisect_left(buckets, size)
+    if idx < len(buckets):
+        return buckets[idx]
+    return -(-size // buckets[-1]) * buckets[-1]
+
+
+class BucketedCompiledModel:
+    """Callable that pads graph batches to bucket sizes before running the compiled model.
+
+    Deliberately not a `torch.nn.Module`, so that the wrapped model's parameters are not
+    registered (and checkpointed) twice when this is stored on a `LightningModule`.
+
+    Args:
+        model (torch.nn.Module): Model taking a (padded) `torch_geometric` batch.
+        node_buckets (Sequence[int]): Allowed padded node counts.
+        edge_buckets (Sequence[int]): Allowed padded edge counts, disjoint from `node_buckets`.
+        backend (str, optional): `torch.compile` backend. Defaults to "inductor", which also
+            runs on CPU.
+        **compile_kwargs: Passed on to `torch.compile`.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        node_buckets: Sequence[int] = DEFAULT_NODE_BUCKETS,
+        edge_buckets: Sequence[int] = DEFAULT_EDGE_BUCKETS,
+        backend: str = "inductor",
+        **compile_kwargs,
+    ) -> None:
+        if set(node_buckets) & set(edge_buckets):
+            raise ValueError(
+                "Node and edge buckets must be disjoint to tell node- from edge-level outputs, "
+                f"got common sizes {sorted(set(node_buckets) & set(edge_buckets))}."
+            )
+        self.model = model
+        self.node_buckets = sorted(node_buckets)
+        self.edge_buckets = sorted(edge_buckets)
+        self.buckets_seen = set()
+        self._graphs_at_start = self._dynamo_unique_graphs()
+        self.compiled_model = torch.compile(model, backend=backend, dynamic=False, **compile_kwargs)
+
+        # Every bucket is a separate specialisation of the same `forward` code object. Dynamo
+        #  falls back to eager beyond `cache_size_limit` specialisations, so this limit is
+        #  raised while the compiled model runs (see `__call__`), without changing it globally.
+        self.cache_size_limit = len(self.node_buckets) * len(self.edge_buckets) * 8
+
+    @staticmethod
+    def _dynamo_unique_graphs() -> int:
+        # pylint: disable=protected-access
+        return torch._dynamo.utils.counters["stats"]["unique_graphs"]
+
+    @property
+    def num_buckets(self) -> int:
+        """Number of distinct ((nodes, edges, graphs), grad mode) buckets seen so far. Each
+        of these is expected to be compiled once."""
+        return len(self.buckets_seen)
+
+    @property
+    def num_compilations(self) -> int:
+        """Number of graphs dynamo compiled since this model was created.
+        NOTE: dynamo's counters are process-wide, other compiled models are included."""
+        return self._dynamo_unique_graphs() - self._graphs_at_start
+
+    @property
+    def num_recompilations(self) -> int:
+        """Number of compilations beyond the expected one per bucket. Non-zero values point
+        at graph breaks or guard failures that bucketing did not absorb."""
+        return max(self.num_compilations - self.num_buckets, 0)
+
+    def pad(self, data: Data) -> Tuple[Data, Tuple[int, int, int], Tuple[int, int, int]]:
+        """Pad `data` to bucket sizes.
+
+        Returns:
+            (padded data, real (nodes, edges, graphs) sizes, padded sizes)
+        """
+        num_nodes, num_edges = data.num_nodes, data.num_edges
+        num_graphs = getattr(data, "num_graphs", 1)
+        # Always reserve one padding node (target of padding edges) and one padding graph.
+        node_bucket = get_bucket(num_nodes + 1, self.node_buckets)
+        edge_bucket = get_bucket(num_edges, self.edge_buckets)
+        graph_bucket = 1 << num_graphs.bit_length()  # next power of two > num_graphs
+        while graph_bucket in (node_bucket, edge_bucket):
+            graph_bucket *= 2
+        if node_bucket == edge_bucket:
+            raise ValueError(
+                f"{num_nodes} nodes and {num_edges} edges both pad to {node_bucket}, which makes "
+                "node- and edge-level outputs indistinguishable. Extend the buckets."
+            )
+        pad_nodes, pad_edges = node_bucket - num_nodes, edge_bucket - num_edges
+
+        padded = {}
+        for key, value in data:
+            if not isinstance(value, torch.Tensor):
+                padded[key] = value
+            elif key == "ptr":
+                continue  # Stale after padding, recomputable from `batch` if needed.
+            elif key == "edge_index":
+                fill = value.new_full((2, pad_edges), node_bucket - 1)
+                padded[key] = torch.cat([value, fill], dim=1)
+            elif key == "batch":
+                fill = value.new_full((pad_nodes,), graph_bucket - 1)
+                padded[key] = torch.cat([value, fill])
+            elif data.is_node_attr(key):
+                padded[key] = torch.cat([value, value.new_zeros((pad_nodes, *value.shape[1:]))])
+            elif data.is_edge_attr(key):
+                padded[key] = torch.cat([value, value.new_zeros((pad_edges, *value.shape[1:]))])
+            else:
+                padded[key] = value
+
+        if "batch" not in padded:
+            device = data.edge_index.device
+            padded["batch"] = torch.cat(
+                [
+                    torch.zeros(num_nodes, dtype=torch.long, device=device),
+                    torch.full((pad_nodes,), graph_bucket - 1, dtype=torch.long, device=device),
+                ]
+            )
+        device = padded["batch"].device
+        padded["node_mask"] = torch.arange(node_bucket, device=device) < num_nodes
+        padded["edge_mask"] = torch.arange(edge_bucket, device=device) < num_edges
+
+        padded_data = Data(**padded)
+        padded_data.num_nodes = node_bucket
+        padded_data.num_graphs = graph_bucket
+        return (
+            padded_data,
+            (num_nodes, num_edges, num_graphs),
+            (node_bucket, edge_bucket, graph_bucket),
+        )
+
+    @staticmethod
+    def unpad(output: Any, sizes: Tuple[int, int, int], buckets: Tuple[int, int, int]) -> Any:
+        """Slice node-, edge- and graph-level outputs back to their real sizes."""
+        if isinstance(output, (tuple, list)):
+            return type(output)(BucketedCompiledModel.unpad(o, sizes, buckets) for o in output)
+        if isinstance(output, dict):
+            return {k: BucketedCompiledModel.unpad(o, sizes, buckets) for k, o in output.items()}
+        if not isinstance(output, torch.Tensor) or output.dim() == 0:
+            return output
+        for size, bucket in zip(sizes, buckets):
+            if output.shape[0] == bucket:
+                return output[:size]
+        return output
+
+    def __call__(self, data: Data) -> Any:
+        padded_data, sizes, buckets = self.pad(data)
+        # Training and no-grad (validation) runs are compiled separately
+        bucket_key = (buckets, torch.is_grad_enabled())
+        if bucket_key not in self.buckets_seen:
+            logger.info("New bucket ((nodes, edges, graphs), grad) = %s, compiling.", bucket_key)
+            self.buckets_seen.add(bucket_key)
+        # pylint: disable=protected-access
+        limit = max(torch._dynamo.config.cache_size_limit, self.cache_size_limit)
+        with torch._dynamo.config.patch(cache_size_limit=limit):
+            output = self.compiled_model(padded_data)
+        return self.unpad(output, sizes, buckets)
+
+
+def get_compiled_model(model: torch.nn.Module, compile_cfg) -> BucketedCompiledModel:
+    """Wrap `model` for bucketed compilation given the `compile` section of the config."""
+    return BucketedCompiledModel(
+        model,
+        node_buckets=compile_cfg.get("node_buckets", DEFAULT_NODE_BUCKETS),
+        edge_buckets=compile_cfg.get("edge_buckets", DEFAULT_EDGE_BUCKETS),
+        backend=compile_cfg.get("backend", "inductor"),
+        mode=compile_cfg.get("mode", None),
+    )
@@ -0,0 +1,104 @@
+"""Registry of losses with a per-graph mean reduction.
+
+Every loss is averaged within each graph first (segment mean over the `batch` vector for
+node-level targets) and then over the graphs in the batch. The gradient scale therefore does
+not depend on the batch size or on the number of nodes per graph. For multi-task targets of
+shape (n, n_tasks), per-task weights are applied to the elementwise loss before the single
+reduction pass.
+
+New losses are added with the `register_loss` decorator and selected via `cfg.loss.name`.
+"""
+import functools
+from typing import Callable, Dict, Optional, Sequence
+
+import torch
+import torch.nn.functional as F
+
+from src.utils.logutils import get_logger
+from src.utils.metrics import per_graph_mean_values
+
+logger = get_logger(__name__)
+
+LOSSES: Dict[str, Callable[..., torch.Tensor]] = {}
+
+
+def register_loss(name: str) -> Callable:
+    """Register an elementwise loss `fn(y, y_hat, **kwargs)` under `name`.
+    The returned tensor is weighted and reduced in place, so its backward must not depend
+    on it (true for the `torch.nn.functional` losses with `reduction="none"`)."""
+
+    def decorator(fn: Callable[..., torch.Tensor]) -> Callable[..., torch.Tensor]:
+        LOSSES[name] = fn
+        return fn
+
+    return decorator
+
+
+@register_loss("mse")
+def mse(y: torch.Tensor, y_hat: torch.Tensor) -> torch.Tensor:
+    return F.mse_loss(y_hat, y, reduction="none")
+
+
+@register_loss("huber")
+def huber(y: torch.Tensor, y_hat: torch.Tensor, delta: float = 1.0) -> torch.Tensor:
+    return F.huber_loss(y_hat, y, reduction="none", delta=delta)
+
+
+@register_loss("bce")
+def bce(y: torch.Tensor, y_hat: torch.Tensor) -> torch.Tensor:
+    # Expects logits, the fused version is numerically stable and avoids a sigmoid tensor
+    return F.binary_cross_entropy_with_logits(y_hat, y.to(y_hat.dtype), reduction="none")
+
+
+def per_graph_mean(
+    values: torch.Tensor, batch: Optional[torch.Tensor] = None, num_graphs: Optional[int] = None
+) -> torch.Tensor:
+    """Mean over graphs of the per-graph mean of `values`.
+    Args:
+        values (torch.Tensor): Loss values with the sample (graph or node) along dim 0.
+        batch (torch.Tensor, optional): Graph index of each row of `values` for node-level
+            values. Ignored if it does not match the number of rows (graph-level values).
+        num_graphs (int, optional): Number of graphs, inferred from `batch` if not given.
+    Returns:
+        Scalar loss.
+    """
+    values = values.reshape(len(values), -1).sum(dim=1)
+    return per_graph_mean_values(values, batch=batch, num_graphs=num_graphs).mean()
+
+
+def weighted_loss(
+    y: torch.Tensor,
+    y_hat: torch.Tensor,
+    batch: Optional[torch.Tensor] = None,
+    num_graphs: Optional[int] = None,
+    loss_fn: Callable[..., torch.Tensor] = mse,
+    task_weights: Optional[torch.Tensor] = None,
+    **loss_kwargs,
+) -> torch.Tensor:
+    """Elementwise loss, weighted over the task dimension and reduced per graph."""
+    values = loss_fn(y, y_hat, **loss_kwargs)
+    if task_weights is not None:
+        values = values.mul_(task_weights.to(values))
+    elif values.dim() > 1:
+        # Turns the sum over tasks in `per_graph_mean` into a mean
+        values = values.div_(values[0].numel())
+    return per_graph_mean(values, batch=batch, num_graphs=num_graphs)
+
+
+def get_loss(
+    name: str, task_weights: Optional[Sequence[float]] = None, **loss_kwargs
+) -> Callable[..., torch.Tensor]:
+    """Return the loss `fn(y, y_hat, batch=None, num_graphs=None)` registered as `name`.
+    Args:
+        name (str): Name of the loss in `LOSSES`.
+        task_weights (Sequence[float], optional): Weight of each task (last dimension of the
+            targets). Defaults to None, which averages over tasks.
+        **loss_kwargs: Passed on to the loss, e.g. `delta` for "huber".
+    """
+    if name not in LOSSES:
+        raise NotImplementedError(f"Loss {name} not implemented. Available: {list(LOSSES)}")
+    if task_weights is not None:
+        task_weights = torch.as_tensor(list(task_weights), dtype=torch.float32)
+    return functools.partial(
+        weighted_loss, loss_fn=LOSSES[name], task_weights=task_weights, **loss_kwargs
+    )
@@ -1,5 +1,5 @@
 """Pytorch Lightning Sample model skeleton."""
-from typing import List
+from typing import List, Optional
 
 import pytorch_lightning as pl
 import torch
@@ -7,6 +7,9 @@ from omegaconf import DictConfig
 from torch.utils.data import DataLoader, Dataset
 
 from src.utils.logutils import get_logger
+from src.utils.metrics import mean_confidence_interval, per_graph_mean_values
+from src.models.bucketing import get_compiled_model
+from src.models.losses import get_loss
 from src.models.utils import get_model
 
 logger = get_logger(__file__)
@@ -21,27 +24,59 @@ class SampleModel(pl.LightningModule):
         
         # Define the model
         self.model: torch.nn.Module = get_model(config)
-        
+        # Optionally compile the model with graph sizes padded to a fixed set of buckets
+        self.compiled_model = None
+        if config.get("compile") is not None and config.compile.enabled:
+            self.compiled_model = get_compiled_model(self.model, config.compile)
+
         # Define the loss
-        self.loss = self.configure_loss(config.loss)
+        self.loss = self.configure_loss(**config.loss)
 
     def forward(self, x):
+        if self.compiled_model is not None:
+            return self.compiled_model(x)
         return self.model(x)
 
-    def shared_step(batch: torch.Tensor):
+    def shared_step(self, batch: torch.Tensor):
         x, y = batch[0], batch[1]
         y_hat = self(x)  # Calls self.forward(x)
         return y, y_hat
 
     def training_step(self, batch: torch.Tensor, _):
         y, y_hat = self.shared_step(batch)
-        loss = self.loss(y, y_hat)
+        # The graph index of each node is needed to average node-level losses per graph
+        x = batch[0]
+        loss = self.loss(y, y_hat, batch=getattr(x, "batch", None),
+                         num_graphs=getattr(x, "num_graphs", None))
         self.log("train_loss", loss)  # Logs to wandb
         return loss
 
-    def validation_step(self, batch: torch.Tensor, _):
+    def on_train_epoch_end(self) -> None:
+        if self.compiled_model is not None:
+            self.log("compile/num_buckets", float(self.compiled_model.num_buckets))
+            self.log("compile/num_compilations", float(self.compiled_model.num_compilations))
+            self.log("compile/num_recompilations", float(self.compiled_model.num_recompilations))
+
+    def validation_step(self, batch: torch.Tensor, batch_idx: int, dataloader_idx: int = 0):
         y, y_hat = self.shared_step(batch)
-        return y, y_hat
+        x = batch[0]
+        metric = self.per_sample_metric(
+            y, y_hat, batch=getattr(x, "batch", None), num_graphs=getattr(x, "num_graphs", None)
+        )
+        return y, y_hat, metric
+
+    @staticmethod
+    def per_sample_metric(
+        y: torch.Tensor,
+        y_hat: torch.Tensor,
+        batch: Optional[torch.Tensor] = None,
+        num_graphs: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Evaluation metric for each graph in the batch, by default the mean squared error.
+        Node-level values are averaged per graph, so that samples (for confidence intervals
+        and population sizes) are graphs, not nodes."""
+        values = ((y - y_hat) ** 2).reshape(len(y), -1).mean(dim=1)
+        return per_graph_mean_values(values, batch=batch, num_graphs=num_graphs)
 
     def on_validation_epoch_start(self) -> None:
         logger.info("Validation epoch started")
@@ -49,11 +84,42 @@ class SampleModel(pl.LightningModule):
         # For example if your dataset has a switch, etc.
 
     def validation_epoch_end(self, outputs: List) -> None:
-        y_list, y_pred_list = [], []
-        for y, y_pred in outputs:
-            y_list.append(y)
-            y_pred_list.append(y_pred)
-        self.log("Validation: wohoo", 1)  # Logs to wandb
+        metric_name = self.config.eval_metrics
+        val_subsample = self.config.get("val_subsample")
+        if val_subsample is None or not val_subsample.enabled:
+            self._log_validation_metric(outputs, f"Validation: {metric_name}")
+            return
+
+        # With subsampled validation, outputs are [subsample outputs, full set outputs]. The
+        #  full set is only iterated at checkpoint boundaries, so it is usually empty.
+        subsample_outputs, full_outputs = outputs
+        self._log_validation_metric(
+            subsample_outputs,
+            f"Validation (subsample): {metric_name}",
+            confidence=val_subsample.confidence,
+            population_size=len(self.trainer.datamodule.val_dataset),
+        )
+        if len(full_outputs) > 0:
+            self._log_validation_metric(full_outputs, f"Validation: {metric_name}")
+
+    def _log_validation_metric(
+        self,
+        outputs: List,
+        name: str,
+        confidence: Optional[float] = None,
+        population_size: Optional[int] = None,
+    ) -> None:
+        """Log the mean of the per-sample metric and, optionally, its confidence interval."""
+        metric_values = torch.cat([metric for _, _, metric in outputs])
+        if confidence is None:
+            self.log(name, metric_values.mean())  # Logs to wandb
+            return
+        mean, ci_low, ci_high = mean_confidence_interval(
+            metric_values, confidence=confidence, population_size=population_size
+        )
+        self.log(name, mean)
+        self.log(f"{name} ci_low", ci_low)
+        self.log(f"{name} ci_high", ci_high)
 
     def test_step(self, batch: torch.Tensor, batch_idx: int):
         return self.validation_step(batch, batch_idx)
@@ -65,7 +131,7 @@ class SampleModel(pl.LightningModule):
 
     def test_epoch_end(self, outputs: List) -> None:
         y_list, y_pred_list = [], []
-        for y, y_pred in outputs:
+        for y, y_pred, _ in outputs:
             y_list.append(y)
             y_pred_list.append(y_pred)
         # TODO: Calculate metrics here
@@ -76,8 +142,7 @@ class SampleModel(pl.LightningModule):
         opt = torch.optim.Adam(params=self.parameters(), lr=self.config.learning_rate)
         return opt
 
-    def configure_loss(self, name: str):
-        """Return the loss function based on the config."""
+    def configure_loss(self, name: str, **loss_kwargs):
+        """Return the loss function based on the config (see `src.models.losses`)."""
         logger.info("Selecting loss function: %s", name)
-        dummy_loss = lambda y, y_hat: torch.sum((y - y_hat) ** 2)
-        return dummy_loss
+        return get_loss(name, **loss_kwargs)
@@ -1,7 +1,58 @@
-from pytorch_lightning.callbacks import Callback, ModelCheckpoint
+import math
+
+from pytorch_lightning.callbacks import Callback, EarlyStopping, ModelCheckpoint
+
+from src.utils.telemetry import ResourceTelemetry
 
 
 ## Define own callbacks here
+class FullValidationGate(Callback):
+    """Runs the full validation set only at checkpoint boundaries.
+
+    Requires the datamodule to validate on a subsample (`val_subsample.enabled`), in which
+    case its second validation dataloader iterates the full set only while its
+    `full_val_sampler` is open. The gate is opened for the last validation run scheduled in
+    every `every_n_epochs`-th epoch and closed again afterwards. With a `val_check_interval`
+    that does not divide the epoch, that run is not on the last training batch.
+    """
+
+    def __init__(self, every_n_epochs: int = 1) -> None:
+        self.every_n_epochs = every_n_epochs
+        self._val_runs_in_epoch = 0
+
+    @staticmethod
+    def _sampler(trainer):
+        return getattr(trainer.datamodule, "full_val_sampler", None)
+
+    @staticmethod
+    def _val_runs_per_epoch(trainer):
+        """Number of validation runs lightning schedules per training epoch, None if unknown."""
+        num_batches, val_check_batch = trainer.num_training_batches, trainer.val_check_batch
+        if math.isinf(num_batches):
+            return None
+        if math.isinf(val_check_batch) or val_check_batch > num_batches:
+            return 1  # Only validates at the end of the epoch
+        return num_batches // val_check_batch
+
+    def on_train_epoch_start(self, trainer, pl_module) -> None:
+        self._val_runs_in_epoch = 0
+
+    def on_validation_start(self, trainer, pl_module) -> None:
+        sampler = self._sampler(trainer)
+        if sampler is None or trainer.sanity_checking:
+            return
+        self._val_runs_in_epoch += 1
+        val_runs_per_epoch = self._val_runs_per_epoch(trainer)
+        if val_runs_per_epoch is None:
+            is_last_val_run = trainer.is_last_batch
+        else:
+            is_last_val_run = self._val_runs_in_epoch == val_runs_per_epoch
+        sampler.is_open = is_last_val_run and (trainer.current_epoch + 1) % self.every_n_epochs == 0
+
+    def on_validation_end(self, trainer, pl_module) -> None:
+        sampler = self._sampler(trainer)
+        if sampler is not None:
+            sampler.is_open = False
 
 
 
@@ -13,17 +64,49 @@ def get_callbacks(cfg):
     if 'checkpointing' in cfg.callbacks:
         ckpt_dir.mkdir(exist_ok=True)
         # Saves the top k checkpoints according to the test metric throughout
-        # training.
+        # training. With subsampled validation, the full set metric is missing from most
+        # validation runs, so monitor the subsample metric which is always logged.
+        monitor = f"Validation: {cfg.eval_metrics}"
+        if cfg.val_subsample.enabled:
+            monitor = f"Validation (subsample): {cfg.eval_metrics}"
         ckpt = ModelCheckpoint(
             dirpath=ckpt_dir,
             filename="{epoch}",
             period=cfg.checkpoint_freq,
-            monitor=f"Validation: {cfg.eval_metrics}",
+            monitor=monitor,
             save_top_k=cfg.save_top_k,
             mode="min",
         )
         callacks.append(ckpt)
 
+    if cfg.val_subsample.enabled:
+        checkpoint_freq = cfg.callbacks.get("checkpointing", {}).get("checkpoint_freq", 1)
+        callacks.append(FullValidationGate(every_n_epochs=checkpoint_freq))
+
+    if 'early_stopping' in cfg.callbacks:
+        # Monitor the optimistic bound of the subsample metric's confidence interval, so that
+        #  training only stops once even that has not improved for `patience` validations.
+        monitor = f"Validation: {cfg.eval_metrics}"
+        if cfg.val_subsample.enabled:
+            monitor = f"Validation (subsample): {cfg.eval_metrics} ci_low"
+        patience = cfg.callbacks.early_stopping.patience
+        callacks.append(EarlyStopping(monitor=monitor, patience=patience, mode="min"))
+
+    if 'resource_telemetry' in cfg.callbacks:
+        # Samples memory, CPU, file descriptors and I/O of the main and DataLoader worker
+        #  processes in a background thread.
+        telemetry_cfg = cfg.callbacks.resource_telemetry
+        callacks.append(
+            ResourceTelemetry(
+                csv_path=telemetry_cfg.csv_path,
+                interval=telemetry_cfg.interval,
+                log_every_n_steps=telemetry_cfg.log_every_n_steps,
+                with_pss=telemetry_cfg.with_pss,
+                leak_window=telemetry_cfg.leak_window,
+                leak_threshold_mb_per_min=telemetry_cfg.leak_threshold_mb_per_min,
+            )
+        )
+
     # TODO add your own callbacks here
     
     return callacks
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""Helpers to aggregate evaluation metrics."""
+from statistics import NormalDist
+from typing import Optional, Tuple
+
+import torch
+
+
+def per_graph_mean_values(
+    values: torch.Tensor, batch: Optional[torch.Tensor] = None, num_graphs: Optional[int] = None
+) -> torch.Tensor:
+    """Segment mean of per-row `values` over the graphs given by `batch`.
+    Args:
+        values (torch.Tensor): 1D tensor with one value per row (node or graph).
+        batch (torch.Tensor, optional): Graph index of each row for node-level values.
+            Ignored if it does not match the number of rows (values are already per graph).
+        num_graphs (int, optional): Number of graphs, inferred from `batch` if not given.
+    Returns:
+        Tensor of shape (num_graphs,) with the mean value of each graph.
+    """
+    if batch is None or len(batch) != len(values):
+        return values
+    if num_graphs is None:
+        num_graphs = int(batch.max()) + 1
+    counts = torch.bincount(batch, minlength=num_graphs).clamp_(min=1)
+    sums = values.new_zeros(num_graphs).index_add_(0, batch, values)
+    return sums.div_(counts)
+
+
+def mean_confidence_interval(
+    values: torch.Tensor,
+    confidence: float = 0.95,
+    population_size: Optional[int] = None,
+) -> Tuple[float, float, float]:
+    """Return the mean of per-sample metric values and a normal-approximation confidence
+    interval on it.
+    Args:
+        values (torch.Tensor): 1D tensor of per-sample metric values. Samples are assumed to
+            be independent, so node-level values should first be reduced per graph (see
+            `per_graph_mean_values`).
+        confidence (float, optional): Confidence level of the interval. Defaults to 0.95.
+        population_size (int, optional): Size of the set `values` were sampled from without
+            replacement. If given, applies the finite population correction, so that the
+            interval shrinks to zero as the subsample approaches the full set.
+    Returns:
+        (mean, lower bound, upper bound)
+    """
+    values = values.detach().double().flatten()
+    n_samples = values.numel()
+    if n_samples < 2:
+        raise ValueError(f"A confidence interval needs at least 2 samples, got {n_samples}.")
+    mean = values.mean().item()
+
+    std_err = values.std(unbiased=True).item() / n_samples**0.5
+    if population_size is not None and population_size > 1:
+        std_err *= max(population_size - n_samples, 0) ** 0.5 / (population_size - 1) ** 0.5
+    half_width = NormalDist().inv_cdf(0.5 + confidence / 2) * std_err
+    return mean, mean - half_width, mean + half_width
@@ -1,12 +1,18 @@
 """Plot style for publication quality figures"""
+import functools
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from distutils.spawn import find_executable
-from typing import Sequence, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import matplotlib
+import matplotlib.pyplot as plt
 import matplotlib.style
 import numpy as np
 import seaborn as sns
+from matplotlib.colors import LogNorm
 
 
 @dataclass
@@ -19,13 +25,28 @@ class TEXTWIDTHS:
     LATEX_ARTICLE: float = 345.0
 
 
-def matplotlib_defaults(use_tex: bool = True, autoupdate: bool = False) -> None:
+@functools.lru_cache(maxsize=None)
+def latex_available() -> bool:
+    """Whether a latex executable is on the path. Probed once per process."""
+    # See: https://matplotlib.org/stable/tutorials/text/usetex.html
+    print("Finding latex executable...")
+    found = shutil.which("latex") is not None
+    print("Found. Using latex backend." if found else "Latex executable not found.")
+    return found
+
+
+def matplotlib_defaults(
+    use_tex: bool = True, autoupdate: bool = False, large_data: bool = False
+) -> None:
     """Apply plotting style to produce nice looking figures.
     Call this at the start of a script which uses `matplotlib`.
     Can enable `matplotlib` LaTeX backend if it is available.
     Args:
         use_tex (bool, optional): Whether or not to use latex matplotlib backend.
             Defaults to True.
+        large_data (bool, optional): Tune rendering for plots with very many points
+            (path simplification and chunking).
+            Defaults to False.
     """
     # matplotlib.use('agg') this used to be required for jasmin
     p_general = {
@@ -49,11 +70,7 @@ def matplotlib_defaults(use_tex: bool = True, autoupdate: bool = False) -> None:
         "text.usetex": False,
     }
     if use_tex:
-        try:
-            # See: https://matplotlib.org/stable/tutorials/text/usetex.html
-            print("Finding latex executable...")
-            assert find_executable("latex")
-            print("Found. Using latex backend.")
+        if latex_available():
             p_tex = {
                 "pgf.texsystem": "pdflatex",
                 "text.usetex": True,
@@ -63,8 +80,15 @@ def matplotlib_defaults(use_tex: bool = True, autoupdate: bool = False) -> None:
                 ),
             }
             p_general.update(p_tex)
-        except:
-            print("Latex executable not found, deactivating latex backend.")
+        else:
+            print("Deactivating latex backend.")
+    if large_data:
+        p_large = {
+            "path.simplify": True,
+            "path.simplify_threshold": 1.0,
+            "agg.path.chunksize": 10000,
+        }
+        p_general.update(p_large)
     if autoupdate:
         matplotlib.rcParams.update(p_general)
     return p_general
@@ -165,6 +189,142 @@ def set_dim(
     )
 
 
+def rasterized_scatter(
+    ax: matplotlib.axes.Axes,
+    x: np.ndarray,
+    y: np.ndarray,
+    max_points: Optional[int] = None,
+    seed: int = 0,
+    **scatter_kwargs,
+) -> matplotlib.collections.PathCollection:
+    """Scatter plot for many points that stays small in vector (pdf/svg) output.
+    The points are drawn as a single rasterised image, while axes and labels remain vectors.
+    Args:
+        ax (matplotlib.axes.Axes): Axes to draw on.
+        x (np.ndarray): x coordinates.
+        y (np.ndarray): y coordinates.
+        max_points (int, optional): If given, draw a fixed random subset of at most this
+            many points. Defaults to None (draw all points).
+        seed (int, optional): Seed for the subset selection. Defaults to 0.
+        **scatter_kwargs: Passed on to `ax.scatter`.
+    Returns:
+        The `PathCollection` of the scatter plot.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if max_points is not None and len(x) > max_points:
+        idx = np.random.default_rng(seed).choice(len(x), size=max_points, replace=False)
+        x, y = x[idx], y[idx]
+    scatter_kwargs.setdefault("s", 1)
+    scatter_kwargs.setdefault("linewidths", 0)
+    scatter_kwargs.setdefault("marker", ".")
+    return ax.scatter(x, y, rasterized=True, **scatter_kwargs)
+
+
+def binned_density(
+    ax: matplotlib.axes.Axes,
+    x: np.ndarray,
+    y: np.ndarray,
+    bins: int = 200,
+    value_range: Optional[Sequence[Tuple[float, float]]] = None,
+    log: bool = True,
+    colorbar: bool = True,
+    **imshow_kwargs,
+) -> matplotlib.image.AxesImage:
+    """2D histogram of many points, rendered as a single rasterised image.
+    Cost of drawing and file size do not depend on the number of points.
+    Args:
+        ax (matplotlib.axes.Axes): Axes to draw on.
+        x (np.ndarray): x coordinates.
+        y (np.ndarray): y coordinates.
+        bins (int, optional): Number of bins along each axis. Defaults to 200.
+        value_range (Sequence[Tuple[float, float]], optional): ((xmin, xmax), (ymin, ymax)) of
+            the histogram. Defaults to the range of the data.
+        log (bool, optional): Use a logarithmic colour scale. Defaults to True.
+        colorbar (bool, optional): Whether to add a colour bar with the counts.
+            Defaults to True.
+        **imshow_kwargs: Passed on to `ax.imshow`.
+    Returns:
+        The `AxesImage` of the histogram (empty bins are transparent).
+    """
+    counts, x_edges, y_edges = np.histogram2d(
+        np.asarray(x).ravel(), np.asarray(y).ravel(), bins=bins, range=value_range
+    )
+    counts = np.ma.masked_equal(counts.T, 0)
+    imshow_kwargs.setdefault("aspect", "auto")
+    imshow_kwargs.setdefault("interpolation", "nearest")
+    image = ax.imshow(
+        counts,
+        origin="lower",
+        extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]),
+        norm=LogNorm() if log else None,
+        rasterized=True,
+        **imshow_kwargs,
+    )
+    if colorbar:
+        ax.figure.colorbar(image, ax=ax, label="Count")
+    return image
+
+
+VECTOR_FORMATS = (".pdf", ".svg", ".eps", ".ps", ".pgf")
+VECTOR_RASTER_DPI = 300
+
+
+def _init_plot_worker(rc_params: Dict[str, Any]) -> None:
+    matplotlib.use("agg")
+    matplotlib.rcParams.update(rc_params)
+
+
+def _render_figure(
+    plot_fn: Callable[..., matplotlib.figure.Figure], out_path: str, kwargs: Dict[str, Any]
+) -> str:
+    fig = plot_fn(**kwargs)
+    # Resolution of rasterised artists (e.g. density images) inside vector output only,
+    #  raster formats keep the default resolution.
+    dpi = VECTOR_RASTER_DPI if os.path.splitext(out_path)[1].lower() in VECTOR_FORMATS else None
+    fig.savefig(out_path, bbox_inches="tight", dpi=dpi)
+    plt.close(fig)
+    return out_path
+
+
+def render_figures(
+    plot_fn: Callable[..., matplotlib.figure.Figure],
+    jobs: Iterable[Tuple[os.PathLike, Dict[str, Any]]],
+    n_workers: Optional[int] = None,
+    use_tex: bool = True,
+    large_data: bool = True,
+) -> List[str]:
+    """Render many figures in parallel worker processes using the shared style.
+    Workers are spawned (not forked), and rasterised artists in vector output (pdf, svg, ...)
+    are saved at `VECTOR_RASTER_DPI`.
+    Args:
+        plot_fn (Callable): Function returning a `matplotlib` figure. Must be picklable,
+            i.e. defined at the top level of an importable module.
+        jobs (Iterable[Tuple[os.PathLike, Dict]]): (output path, keyword arguments to
+            `plot_fn`) for each figure.
+        n_workers (int, optional): Number of worker processes. Defaults to the number of
+            CPUs.
+        use_tex (bool, optional): Passed on to `matplotlib_defaults`. Defaults to True.
+        large_data (bool, optional): Passed on to `matplotlib_defaults`. Defaults to True.
+    Returns:
+        paths (List[str]): Paths of the saved figures, in the order of `jobs`.
+    """
+    # Probe latex once here rather than in every worker
+    rc_params = matplotlib_defaults(use_tex=use_tex, large_data=large_data)
+    jobs = list(jobs)
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        # Fork is unsafe in processes with running threads (e.g. telemetry, data loading)
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_plot_worker,
+        initargs=(rc_params,),
+    ) as executor:
+        futures = [
+            executor.submit(_render_figure, plot_fn, str(out_path), kwargs)
+            for out_path, kwargs in jobs
+        ]
+        return [future.result() for future in futures]
+
+
 CAMBRIDGE_COLOURS = {
     "Pantone_197": "#E89CAE",
     "Pantone_284": "#6CACE4",
@@ -0,0 +1,300 @@
+"""Resource telemetry for the training process and its DataLoader workers.
+
+`ResourceTelemetry` samples the main process and all of its child processes on a background
+thread, writes every sample to a CSV file and forwards the latest sample to the lightning
+logger. Children are labelled "worker" only if they are DataLoader workers, which register
+themselves through `register_dataloader_worker` (pass it as `worker_init_fn`). All other
+children (e.g. the wandb service or compile workers) are labelled "other".
+
+It also fits a linear trend to the memory (PSS if available, else RSS) of the main process and
+each worker over a sliding window and warns when it keeps growing, which usually points at a
+leak in a transform or dataset (e.g. an ever-growing cache in a worker).
+"""
+import collections
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import psutil
+from pytorch_lightning.callbacks import Callback
+
+from src.utils.logutils import get_logger
+
+logger = get_logger(__name__)
+
+_MB = 1024**2
+# Directory in which DataLoader workers register their pid, inherited by worker processes
+WORKER_DIR_ENV_VAR = "RESOURCE_TELEMETRY_WORKER_DIR"
+CSV_FIELDS = [
+    "time",
+    "step",
+    "role",
+    "pid",
+    "rss_mb",
+    "pss_mb",
+    "cpu_percent",
+    "num_fds",
+    "io_read_mb",
+    "io_write_mb",
+    "samples_per_sec",
+]
+
+
+def register_dataloader_worker(worker_id: int) -> None:  # pylint: disable=unused-argument
+    """`worker_init_fn` marking the calling process as a DataLoader worker for telemetry.
+    Does nothing unless a `ResourceTelemetry` callback is running."""
+    worker_dir = os.environ.get(WORKER_DIR_ENV_VAR)
+    if worker_dir is not None and os.path.isdir(worker_dir):
+        open(os.path.join(worker_dir, str(os.getpid())), "w", encoding="utf-8").close()
+
+
+def _batch_size(batch) -> int:
+    """Number of samples in a batch (graphs for `torch_geometric` batches)."""
+    if hasattr(batch, "num_graphs"):
+        return batch.num_graphs
+    if isinstance(batch, (list, tuple)) and len(batch) > 0:
+        return _batch_size(batch[0])
+    if hasattr(batch, "__len__"):
+        return len(batch)
+    return 1
+
+
+def _process_stats(process: psutil.Process, with_pss: bool) -> Dict[str, float]:
+    """Return a sample of the resources used by `process`. Unsupported fields are NaN."""
+    stats = dict.fromkeys(CSV_FIELDS[4:10], float("nan"))
+    with process.oneshot():
+        if with_pss:
+            try:
+                memory = process.memory_full_info()
+                if hasattr(memory, "pss"):  # Linux only
+                    stats["pss_mb"] = memory.pss / _MB
+            except psutil.AccessDenied:
+                memory = process.memory_info()
+        else:
+            memory = process.memory_info()
+        stats["rss_mb"] = memory.rss / _MB
+        stats["cpu_percent"] = process.cpu_percent(interval=None)
+        if hasattr(process, "num_fds"):  # POSIX only
+            stats["num_fds"] = process.num_fds()
+        if hasattr(process, "io_counters"):  # Not available on macOS
+            io_counters = process.io_counters()
+            stats["io_read_mb"] = io_counters.read_bytes / _MB
+            stats["io_write_mb"] = io_counters.write_bytes / _MB
+    return stats
+
+
+class ResourceTelemetry(Callback):
+    """Samples RSS/PSS, CPU%, open file descriptors, I/O and throughput during training.
+
+    Args:
+        csv_path (os.PathLike): File every sample is appended to.
+        interval (float, optional): Seconds between samples. Defaults to 5.
+        log_every_n_steps (int, optional): How often to send the latest sample to the
+            lightning logger. Defaults to 50.
+        with_pss (bool, optional): Also record PSS, which accounts for memory shared between
+            workers (copy-on-write), but is more expensive to read. Defaults to True.
+        leak_window (float, optional): Seconds of memory history used to detect growth.
+            Defaults to 600.
+        leak_threshold_mb_per_min (float, optional): Warn if the memory of a process grows
+            faster than this over the whole window. Defaults to 10.
+    """
+
+    def __init__(
+        self,
+        csv_path: os.PathLike,
+        interval: float = 5.0,
+        log_every_n_steps: int = 50,
+        with_pss: bool = True,
+        leak_window: float = 600.0,
+        leak_threshold_mb_per_min: float = 10.0,
+    ) -> None:
+        self.csv_path = csv_path
+        self.interval = interval
+        self.log_every_n_steps = log_every_n_steps
+        self.with_pss = with_pss
+        self.leak_window = leak_window
+        self.leak_threshold_mb_per_min = leak_threshold_mb_per_min
+
+        self._main = psutil.Process()
+        self._processes: Dict[int, psutil.Process] = {}
+        self._memory_history: Dict[int, Deque[Tuple[float, float]]] = {}
+        self._last_leak_warning: Dict[int, float] = {}
+        self._latest: Dict[str, float] = {}
+        self._samples_seen = 0
+        self._step = 0
+        self._last_sample: Optional[Tuple[float, int]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._worker_dir: Optional[str] = None
+
+    # --- Sampling (background thread)
+    def _get_process(self, pid: int) -> psutil.Process:
+        # Keep `Process` objects alive, `cpu_percent` is measured since the previous call.
+        if pid not in self._processes:
+            self._processes[pid] = psutil.Process(pid) if pid != self._main.pid else self._main
+            self._processes[pid].cpu_percent(interval=None)
+        return self._processes[pid]
+
+    def _sample(self) -> List[Dict]:
+        now = time.time()
+        samples_seen = self._samples_seen
+        samples_per_sec = float("nan")
+        if self._last_sample is not None:
+            last_time, last_seen = self._last_sample
+            samples_per_sec = (samples_seen - last_seen) / max(now - last_time, 1e-9)
+        self._last_sample = (now, samples_seen)
+
+        # Read the registry before listing children, so a worker registering in between is
+        #  at worst labelled "other" for one sample
+        worker_pids = self._worker_pids()
+        try:
+            children = self._main.children(recursive=True)
+        except psutil.Error:
+            children = []
+        roles = [(self._main.pid, "main")] + [
+            (child.pid, "worker" if child.pid in worker_pids else "other") for child in children
+        ]
+
+        rows = []
+        for pid, role in roles:
+            try:
+                stats = _process_stats(self._get_process(pid), self.with_pss)
+            except psutil.Error:  # Worker exited in the meantime
+                continue
+            rows.append(
+                dict(
+                    time=now,
+                    step=self._step,
+                    role=role,
+                    pid=pid,
+                    samples_per_sec=samples_per_sec,
+                    **stats,
+                )
+            )
+
+        # Forget processes that have exited (e.g. workers at the end of an epoch)
+        alive = {pid for pid, _ in roles}
+        for pid in set(self._processes) - alive:
+            self._processes.pop(pid)
+            self._memory_history.pop(pid, None)
+            self._last_leak_warning.pop(pid, None)
+        for pid in worker_pids - alive:
+            if psutil.pid_exists(pid):
+                continue
+            try:
+                os.remove(os.path.join(self._worker_dir, str(pid)))
+            except OSError:
+                pass
+        return rows
+
+    def _worker_pids(self) -> set:
+        if self._worker_dir is None:
+            return set()
+        return {int(name) for name in os.listdir(self._worker_dir) if name.isdigit()}
+
+    def _check_memory_growth(self, row: Dict) -> None:
+        if row["role"] == "other":
+            return
+        pid, now = row["pid"], row["time"]
+        # RSS of forked workers keeps growing as copy-on-write pages get touched (e.g. by
+        #  reference counting), without any leak. PSS splits shared pages between processes.
+        memory_key = "rss_mb" if np.isnan(row["pss_mb"]) else "pss_mb"
+        history = self._memory_history.setdefault(pid, collections.deque())
+        history.append((now, row[memory_key]))
+        while history and now - history[0][0] > self.leak_window:
+            history.popleft()
+        # Only judge the trend once the history covers (most of) the window
+        if len(history) < 3 or now - history[0][0] < 0.9 * self.leak_window:
+            return
+        if now - self._last_leak_warning.get(pid, -np.inf) < self.leak_window:
+            return
+
+        times, memory = np.asarray(history).T
+        slope_mb_per_min = np.polyfit(times - times[0], memory, deg=1)[0] * 60
+        if slope_mb_per_min > self.leak_threshold_mb_per_min:
+            self._last_leak_warning[pid] = now
+            logger.warning(
+                "%s of %s process %s grew by %.1f MB/min over the last %.0f s (now %.0f MB). "
+                "This may indicate a leak in a transform or dataset.",
+                memory_key[:3].upper(),
+                row["role"],
+                pid,
+                slope_mb_per_min,
+                self.leak_window,
+                row[memory_key],
+            )
+
+    @staticmethod
+    def _summarise(rows: List[Dict]) -> Dict[str, float]:
+        """Aggregate a sample into metrics for the lightning logger."""
+        workers = [row for row in rows if row["role"] == "worker"]
+        others = [row for row in rows if row["role"] == "other"]
+        metrics = {}
+        for row in rows:
+            if row["role"] == "main":
+                for key in ("rss_mb", "pss_mb", "cpu_percent", "num_fds", "samples_per_sec"):
+                    metrics[f"telemetry/main_{key}"] = row[key]
+        metrics["telemetry/num_workers"] = len(workers)
+        for key in ("rss_mb", "pss_mb", "cpu_percent", "num_fds", "io_read_mb"):
+            values = [row[key] for row in workers]
+            if values:
+                metrics[f"telemetry/workers_{key}_total"] = float(np.sum(values))
+                metrics[f"telemetry/workers_{key}_max"] = float(np.max(values))
+        metrics["telemetry/num_other_processes"] = len(others)
+        if others:
+            metrics["telemetry/others_rss_mb_total"] = float(sum(row["rss_mb"] for row in others))
+        return {key: value for key, value in metrics.items() if not np.isnan(value)}
+
+    def _run(self) -> None:
+        write_header = not os.path.exists(self.csv_path)
+        with open(self.csv_path, "a", newline="", encoding="utf-8") as file:
+            writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+            if write_header:
+                writer.writeheader()
+            while not self._stop.wait(self.interval):
+                try:
+                    rows = self._sample()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Resource telemetry sampling failed.")
+                    continue
+                writer.writerows(rows)
+                file.flush()
+                for row in rows:
+                    self._check_memory_growth(row)
+                self._latest = self._summarise(rows)
+
+    # --- Lightning hooks (main thread)
+    def on_fit_start(self, trainer, pl_module) -> None:
+        if not trainer.is_global_zero:
+            return
+        self._stop.clear()
+        # DataLoader workers are started after this hook and inherit the environment
+        self._worker_dir = tempfile.mkdtemp(prefix="dataloader_workers-")
+        os.environ[WORKER_DIR_ENV_VAR] = self._worker_dir
+        self._thread = threading.Thread(target=self._run, name="resource-telemetry", daemon=True)
+        self._thread.start()
+        logger.info("Resource telemetry started, writing to %s", self.csv_path)
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, *args) -> None:
+        self._samples_seen += _batch_size(batch)
+        self._step = trainer.global_step
+        if trainer.logger is not None and self._latest and batch_idx % self.log_every_n_steps == 0:
+            trainer.logger.log_metrics(self._latest, step=trainer.global_step)
+
+    def on_fit_end(self, trainer, pl_module) -> None:
+        self.teardown(trainer, pl_module, stage="fit")
+
+    def teardown(self, trainer, pl_module, stage: Optional[str] = None) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._worker_dir is not None:
+            os.environ.pop(WORKER_DIR_ENV_VAR, None)
+            shutil.rmtree(self._worker_dir, ignore_errors=True)
+            self._worker_dir = None